@@ -0,0 +1,241 @@
+"""
+_zipwrite.py — zip entry writer and git tag lookup shared by prereg_pack.py and zenodo_pack.py.
+
+Entries whose CRC and sizes are known up front are appended straight to the
+ZipFile's stream (append_entry). That goes through ZipFile internals (_lock,
+_writecheck, _didModify, start_dir, _seekable), so it lives here once;
+tests/test_zipwrite.py checks it against ZipFile.write.
+"""
+import os, pathlib, hashlib, mmap, shutil, zipfile, zlib, subprocess, functools, collections
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+def read_git_head():
+    """Resolve HEAD to a full commit hash by reading .git directly; None if that fails."""
+    git = ROOT / ".git"
+    try:
+        if git.is_file():  # worktree/submodule: "gitdir: <path>"
+            git = (ROOT / git.read_text().split(":", 1)[1].strip()).resolve()
+        head = (git / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head or None
+        ref = head[5:]
+        common = git
+        if (git / "commondir").is_file():  # linked worktree: branch refs live in the main repo
+            common = (git / (git / "commondir").read_text().strip()).resolve()
+        for d in (git, common):
+            if (d / ref).is_file():
+                return (d / ref).read_text().strip() or None
+        packed = common / "packed-refs"
+        if packed.is_file():
+            for line in packed.read_text().splitlines():
+                sha, _, name = line.partition(" ")
+                if name == ref:
+                    return sha
+    except (OSError, IndexError):
+        pass
+    return None
+
+@functools.lru_cache(maxsize=1)
+def detect_git_tag():
+    # reading .git avoids a fork+exec; fall back to git for layouts we do not parse
+    sha = read_git_head()
+    if sha:
+        return sha[:7]
+    try:
+        res = subprocess.run(
+            ["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return res.stdout.strip() if res.returncode == 0 else None
+
+# already-compressed payloads (PDF streams are FlateDecode, images are JPEG/PNG):
+# deflating them again burns CPU for ~0% gain
+STORED_EXT = {".pdf", ".png", ".jpg", ".jpeg", ".zip", ".gz", ".xz"}
+
+# deflate_one reads a whole file into memory; files above STREAM_MIN go through
+# ZipFile.write on the writer thread instead, which streams them
+STREAM_MIN = 32 * 1024 * 1024
+# source bytes the deflate workers may have in flight at once
+WINDOW_BYTES = 256 * 1024 * 1024
+
+def is_stored(src):
+    return os.path.splitext(str(src))[1].lower() in STORED_EXT
+
+def is_streamed(src):
+    return os.path.getsize(src) > STREAM_MIN
+
+def deflate_one(path, level, hashed=False):
+    """Raw-deflate one file (worker side); returns (crc32, size, compressed bytes, sha256 or None)."""
+    data = pathlib.Path(path).read_bytes()
+    co = zlib.compressobj(level, zlib.DEFLATED, -15)
+    digest = hashlib.sha256(data).hexdigest() if hashed else None
+    return zlib.crc32(data), len(data), co.compress(data) + co.flush(), digest
+
+def iter_deflated(paths, level, jobs, hashed=False):
+    """Yield deflate_one(path, level, hashed) for paths, in order.
+
+    Workers run ahead by at most 4*jobs files and WINDOW_BYTES of source data
+    (always at least one file), which bounds the blobs held in memory.
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield deflate_one(path, level, hashed)
+        return
+    sizes = [os.path.getsize(p) for p in paths]
+    window = 4 * jobs
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        pending = collections.deque()
+        inflight = 0
+        queued = 0
+        for _ in paths:
+            while queued < len(paths) and (not pending or (len(pending) < window
+                                                          and inflight + sizes[queued] <= WINDOW_BYTES)):
+                pending.append((ex.submit(deflate_one, paths[queued], level, hashed), sizes[queued]))
+                inflight += sizes[queued]
+                queued += 1
+            fut, size = pending.popleft()
+            yield fut.result()
+            inflight -= size
+
+def append_entry(zf, zinfo, write_payload):
+    """Append an entry whose CRC and sizes are already set on zinfo.
+
+    Mirrors ZipFile._open_to_write/_ZipWriteFile.close, but since nothing is
+    computed while writing, the local header is written once, without a back-seek.
+    write_payload(fp) must write exactly zinfo.compress_size bytes at fp's position.
+    """
+    with zf._lock:
+        # seeking a BufferedWriter flushes it, so only seek if something moved fp
+        if zf._seekable and zf.fp.tell() != zf.start_dir:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.write(zinfo.FileHeader())
+        write_payload(zf.fp)
+        zf.start_dir = zf.fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+def write_deflated(zf, src, arcname, crc, size, blob):
+    """Append an entry whose deflate stream was produced elsewhere (see deflate_one)."""
+    zinfo = zipfile.ZipInfo.from_file(src, arcname=str(arcname))
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = len(blob)
+    append_entry(zf, zinfo, lambda fp: fp.write(blob))
+
+def write_streamed(zf, src, arcname, level, hashed=False):
+    """Append a large file through ZipFile.write, which deflates it in constant memory.
+
+    Returns the source's sha256 hex digest if hashed (a second read), else None.
+    """
+    zf.write(src, arcname=str(arcname), compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+    if not hashed:
+        return None
+    h = hashlib.sha256()
+    with open(src, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def copy_in_kernel(in_fd, out_fd, size):
+    """Copy size bytes from in_fd (offset 0) to out_fd's current position without
+    passing them through Python: copy_file_range, else sendfile.
+
+    Returns the number of bytes copied; less than size means the caller must finish
+    the rest in userspace (neither call is available or the kernel refused).
+    """
+    sent = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while sent < size:
+                n = os.copy_file_range(in_fd, out_fd, size - sent, sent)
+                if not n:
+                    break
+                sent += n
+        except OSError:  # e.g. EXDEV/EINVAL on older kernels or odd filesystems
+            pass
+    if sent < size and hasattr(os, "sendfile"):
+        try:
+            while sent < size:
+                n = os.sendfile(out_fd, in_fd, sent, size - sent)
+                if not n:
+                    break
+                sent += n
+        except OSError:
+            pass
+    return sent
+
+def write_stored(zf, src, arcname, hashed=False):
+    """Append a ZIP_STORED entry; CRC (and sha256) come from an mmap pass before the copy.
+
+    The payload itself is copied in-kernel (copy_in_kernel) where the platform allows.
+    Returns the source's sha256 hex digest if hashed, else None.
+    """
+    zinfo = zipfile.ZipInfo.from_file(src, arcname=str(arcname))
+    zinfo.compress_type = zipfile.ZIP_STORED
+    with open(src, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        crc, h = 0, hashlib.sha256() if hashed else None
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                crc = zlib.crc32(mm)
+                if h:
+                    h.update(mm)
+        zinfo.CRC = crc
+        zinfo.file_size = zinfo.compress_size = size
+
+        def payload(fp):
+            fp.flush()
+            start = fp.tell()
+            sent = copy_in_kernel(f.fileno(), fp.fileno(), size)
+            # the bytes bypassed fp's buffer; seek so its cached position catches up
+            fp.seek(start + sent)
+            if sent < size:
+                f.seek(sent)
+                shutil.copyfileobj(f, fp, 1 << 20)
+
+        append_entry(zf, zinfo, payload)
+    return h.hexdigest() if h else None
+
+def iter_dir(base, relroot, exclude_ext=(), exclude_names=(), dirs=None):
+    """Yield (path, arcname) strings under base, in os.walk order.
+
+    One os.scandir per directory driven by an explicit stack; type checks use
+    the cached dirent type, so no per-file stat and no per-directory lists.
+    Skips hidden and __pycache__ directories; exclude_ext matches the end of the name.
+    If dirs is a list, (dir, st_mtime_ns) is appended for every directory walked.
+    """
+    exclude_ext = tuple(ext.lower() for ext in exclude_ext)
+    exclude_names = frozenset(exclude_names)
+    cut = len(str(ROOT)) + 1
+    prefix = str(relroot) + os.sep
+    stack = [str(base)]
+    while stack:
+        d = stack.pop()
+        if dirs is not None:
+            dirs.append((d, os.stat(d).st_mtime_ns))
+        subdirs = []
+        with os.scandir(d) as it:
+            for entry in it:
+                name = entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if name != "__pycache__" and not name.startswith("."):
+                        subdirs.append(entry.path)
+                elif entry.is_file():
+                    if name in exclude_names:
+                        continue
+                    # make_checksums.py's binary manifests are a local index, not a release file
+                    if name.startswith("checksums_SHA256") and name.endswith(".bin"):
+                        continue
+                    if exclude_ext and name.lower().endswith(exclude_ext):
+                        continue
+                    yield entry.path, prefix + entry.path[cut:]
+        # reversed, so the first subdirectory is popped (walked) next, as os.walk does
+        stack.extend(reversed(subdirs))
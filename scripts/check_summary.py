@@ -4,65 +4,131 @@ check_summary.py — emit CSV or Markdown summary of dataset stats.
 
 Now supports --markdown flag to also emit a GitHub/LaTeX-ready table (pipe syntax).
 """
-import argparse, sys, os, math, csv
+import argparse, sys, os, math, functools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import yaml
 
+try:
+    import pyarrow  # noqa: F401  (optional: multithreaded CSV parser + parquet cache)
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
 FIELDS = ["input","kind","n","min_u","max_u","span_u","mean_abs_r","max_abs_r","var_r","min_sigma","max_sigma","has_nan","monotonic_u"]
 
-def stats_for(path):
-    df = pd.read_csv(path)
+READ_COLS = ["u", "residual", "sigma"]
+_READ_OPTS = dict(engine="pyarrow" if HAVE_PYARROW else "c",
+                  usecols=READ_COLS, dtype={c: np.float64 for c in READ_COLS})
+
+def _summarize(u, r, s):
+    # The same reductions as np.nan*, but every temporary goes through one
+    # float and one bool scratch buffer (no np.abs/np.diff/isfinite copies).
+    n = u.size
+    scratch = np.empty(n)
+    mask = np.empty(n, dtype=bool)
+    has_nan = not (np.isfinite(u, out=mask).all() and np.isfinite(r, out=mask).all()
+                   and np.isfinite(s, out=mask).all())
+    min_u = float(np.min(u))
+    max_u = float(np.max(u))
+    # diff(u) >= 0, not u[1:] >= u[:-1]: a repeated +-inf gives inf - inf = NaN -> False
+    np.subtract(u[1:], u[:-1], out=scratch[:n - 1])
+    monotonic_u = bool(np.greater_equal(scratch[:n - 1], 0.0, out=mask[:n - 1]).all())
+    # nanmax / nanmin are fmax / fmin reductions
+    np.abs(r, out=scratch)
+    max_abs_r = float(np.fmax.reduce(scratch))
+    min_sigma = float(np.fmin.reduce(s))
+    max_sigma = float(np.fmax.reduce(s))
+    # nanmean / nanvar: zero the NaNs, divide by the non-NaN count
+    np.isnan(r, out=mask)
+    cnt = n - int(np.count_nonzero(mask))
+    if cnt:
+        np.copyto(scratch, 0.0, where=mask)
+        mean_abs_r = float(np.sum(scratch) / cnt)
+        np.copyto(scratch, r)
+        np.copyto(scratch, 0.0, where=mask)
+        avg = np.sum(scratch) / cnt
+        np.subtract(scratch, avg, out=scratch)
+        np.copyto(scratch, 0.0, where=mask)
+        np.multiply(scratch, scratch, out=scratch)
+        var_r = float(np.sum(scratch) / cnt)
+    else:
+        mean_abs_r = var_r = float("nan")
+    return (min_u, max_u, mean_abs_r, max_abs_r, var_r, min_sigma, max_sigma, has_nan, monotonic_u)
+
+def load_columns(path, parquet_cache=False):
+    """Read the u/residual/sigma columns; optionally via a sibling .parquet cache."""
+    if not (parquet_cache and HAVE_PYARROW):
+        return pd.read_csv(path, **_READ_OPTS)
+    pq_path = os.path.splitext(path)[0] + ".parquet"
+    if os.path.isfile(pq_path) and os.path.getmtime(pq_path) >= os.path.getmtime(path):
+        return pd.read_parquet(pq_path, columns=READ_COLS)
+    df = pd.read_csv(path, **_READ_OPTS)
+    df.to_parquet(pq_path, index=False)
+    return df
+
+def stats_for(path, parquet_cache=False):
+    df = load_columns(path, parquet_cache=parquet_cache)
     u = df["u"].to_numpy(float)
     r = df["residual"].to_numpy(float)
     s = df["sigma"].to_numpy(float)
-    has_nan = (not np.isfinite(u).all()) or (not np.isfinite(r).all()) or (not np.isfinite(s).all())
     n = int(u.size)
-    min_u = float(np.min(u)) if n else float("nan")
-    max_u = float(np.max(u)) if n else float("nan")
-    span_u = float(max_u - min_u) if n else float("nan")
-    mean_abs_r = float(np.nanmean(np.abs(r))) if n else float("nan")
-    max_abs_r = float(np.nanmax(np.abs(r))) if n else float("nan")
-    var_r = float(np.nanvar(r)) if n else float("nan")
-    min_sigma = float(np.nanmin(s)) if n else float("nan")
-    max_sigma = float(np.nanmax(s)) if n else float("nan")
-    monotonic_u = bool(np.all(np.diff(u) >= 0))
-    return dict(n=n, min_u=min_u, max_u=max_u, span_u=span_u,
-                mean_abs_r=mean_abs_r, max_abs_r=max_abs_r, var_r=var_r,
-                min_sigma=min_sigma, max_sigma=max_sigma,
-                has_nan=has_nan, monotonic_u=monotonic_u)
+    if not n:
+        nan = float("nan")
+        return dict(n=0, min_u=nan, max_u=nan, span_u=nan,
+                    mean_abs_r=nan, max_abs_r=nan, var_r=nan,
+                    min_sigma=nan, max_sigma=nan,
+                    has_nan=False, monotonic_u=True)
+    (min_u, max_u, mean_abs_r, max_abs_r, var_r,
+     min_sigma, max_sigma, has_nan, monotonic_u) = _summarize(u, r, s)
+    return dict(n=n, min_u=float(min_u), max_u=float(max_u), span_u=float(max_u - min_u),
+                mean_abs_r=float(mean_abs_r), max_abs_r=float(max_abs_r), var_r=float(var_r),
+                min_sigma=float(min_sigma), max_sigma=float(max_sigma),
+                has_nan=bool(has_nan), monotonic_u=bool(monotonic_u))
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--manifest", required=True)
     ap.add_argument("--out", default=None)
     ap.add_argument("--markdown", action="store_true", help="Emit markdown table too")
+    ap.add_argument("--parquet-cache", action="store_true",
+                    help="Cache parsed columns as <input>.parquet next to each CSV (needs pyarrow)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel worker processes (1 = serial)")
     args = ap.parse_args()
+    if args.parquet_cache and not HAVE_PYARROW:
+        sys.stderr.write("[warn] --parquet-cache needs pyarrow; reading CSVs directly\n")
 
     man = yaml.safe_load(open(args.manifest, "r", encoding="utf-8"))
     figs = man.get("figures", [])
-    rows = []
+    pairs = []
     for spec in figs:
         path = spec.get("input")
         kind = spec.get("kind", "")
         if not path or not os.path.isfile(path):
             continue
-        st = stats_for(path)
-        rows.append({"input": path, "kind": kind, **st})
+        pairs.append((path, kind))
+
+    # each input is independent; fan out across processes (pandas/numpy work holds the GIL)
+    work = functools.partial(stats_for, parquet_cache=args.parquet_cache)
+    paths = [p for p, _ in pairs]
+    jobs = min(len(pairs), args.jobs or 1)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            stats = list(ex.map(work, paths, chunksize=4))
+    else:
+        stats = [work(p) for p in paths]
+    rows = [{"input": path, "kind": kind, **st} for (path, kind), st in zip(pairs, stats)]
 
-    # CSV out
-    writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
-    writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
+    # CSV out: format once with pandas' C writer (DictWriter-compatible: "nan", CRLF)
+    df_out = pd.DataFrame(rows, columns=FIELDS)
+    csv_text = df_out.to_csv(index=False, na_rep="nan", lineterminator="\r\n")
+    sys.stdout.write(csv_text)
 
     if args.out:
         os.makedirs(os.path.dirname(args.out), exist_ok=True)
         with open(args.out, "w", newline="", encoding="utf-8") as fh:
-            writer2 = csv.DictWriter(fh, fieldnames=FIELDS)
-            writer2.writeheader()
-            for row in rows:
-                writer2.writerow(row)
+            fh.write(csv_text)
 
     if args.markdown:
         md_lines = []
@@ -3,77 +3,151 @@
 make_checksums.py — create a SHA256 manifest for the prereg/Zenodo bundle.
 By default mirrors the *no-data* packaging (scripts, reports, figs PDFs, root files).
 Use --include-data to include data/ checksums (for *-data* bundles).
+Digests are cached in .checksums.cache.json (keyed by mtime+size); only changed
+files are rehashed. Use --no-cache to rehash everything.
+Next to the text manifest, a sorted binary copy (<out>.bin) is written for
+verify_archive.py; see write_bin_manifest for the layout.
 
 Example:
   python scripts/make_checksums.py --out reports/checksums_SHA256.txt
   python scripts/make_checksums.py --include-data --out reports/checksums_SHA256_data.txt
 """
-import argparse, os, pathlib, hashlib, sys
+import argparse, os, pathlib, hashlib, json, mmap, sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 
 ROOT_FILES = {"main.pdf","supplemental.pdf","manifest.yaml","Makefile","latexmkrc","plr.bib"}
 
+# rel path -> [mtime_ns, size, sha256]; lives at ROOT so it is never gathered or packed
+CACHE_PATH = ROOT / ".checksums.cache.json"
+
+# files at or above this size go to threads (file_digest releases the GIL), the rest to processes
+THREAD_MIN_SIZE = 32 * 1024 * 1024
+
 def sha256_of(path: pathlib.Path) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024*1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-def should_skip(path: pathlib.Path) -> bool:
-    # skip dist, .git, cachey dirs, and TeX aux
-    parts = set(path.parts)
-    if "dist" in parts or ".git" in parts or "__pycache__" in parts:
-        return True
-    name = path.name
+    # file_digest (3.11+) runs the read loop in C; older Pythons hash one mmap view
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(memoryview(mm))
+        return h.hexdigest()
+
+def hash_files(files, jobs=None):
+    """Return sha256 hex digests for files (same order), hashed in parallel."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) < 2:
+        return [sha256_of(p) for p in files]
+    digests = [None] * len(files)
+    small, large = [], []
+    for i, p in enumerate(files):
+        (large if p.stat().st_size >= THREAD_MIN_SIZE else small).append(i)
+    if large:
+        with ThreadPoolExecutor(max_workers=jobs) as ex:
+            for i, d in zip(large, ex.map(sha256_of, [files[i] for i in large])):
+                digests[i] = d
+    if small:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            for i, d in zip(small, ex.map(sha256_of, [files[i] for i in small], chunksize=8)):
+                digests[i] = d
+    return digests
+
+# skip dist, .git, cachey dirs, and TeX aux
+_SKIP_DIRS = frozenset({".git", "dist", "__pycache__"})
+_SKIP_EXT = frozenset({".aux",".log",".out",".toc",".gz",".synctex",".synctex.gz",".tmp"})
+# top-level dirs to walk: name -> required suffix (None = any)
+_ALLOW_TOP = {"scripts": None, "reports": None, "figs": ".pdf"}
+
+def should_skip(name: str) -> bool:
     if name.startswith(".DS_Store"):
         return True
-    extskip = (".aux",".log",".out",".toc",".gz",".synctex",".synctex.gz",".tmp")
-    if path.suffix in extskip:
+    # binary manifests are an index for verify_archive.py, rewritten on every run
+    if name.startswith("checksums_SHA256") and name.endswith(".bin"):
         return True
-    return False
+    return os.path.splitext(name)[1] in _SKIP_EXT
+
+def _walk(top, only_ext, out):
+    # one scandir per directory; dirent types are cached, symlinked dirs not followed
+    with os.scandir(top) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name not in _SKIP_DIRS:
+                    _walk(entry.path, only_ext, out)
+            elif entry.is_file():
+                if only_ext is not None and not name.endswith(only_ext):
+                    continue
+                if not should_skip(name):
+                    out.append(entry.path)
 
 def gather(include_data=False):
+    allow = dict(_ALLOW_TOP, data=None) if include_data else _ALLOW_TOP
     files = []
-    # Root files
-    for f in ROOT_FILES:
-        p = ROOT / f
-        if p.exists() and p.is_file():
-            files.append(p)
-    # README*
-    for p in ROOT.glob("README*"):
-        if p.is_file():
-            files.append(p)
-    # scripts (all)
-    for p in (ROOT / "scripts").rglob("*"):
-        if p.is_file() and not should_skip(p):
-            files.append(p)
-    # reports (all)
-    rep = ROOT / "reports"
-    if rep.exists():
-        for p in rep.rglob("*"):
-            if p.is_file() and not should_skip(p):
-                files.append(p)
-    # figs (pdf only)
-    figs = ROOT / "figs"
-    if figs.exists():
-        for p in figs.rglob("*.pdf"):
-            if p.is_file() and not should_skip(p):
-                files.append(p)
-    # data optional
-    if include_data and (ROOT / "data").exists():
-        for p in (ROOT / "data").rglob("*"):
-            if p.is_file() and not should_skip(p):
-                files.append(p)
-    # de-dup & sort
-    uniq = sorted(set(files), key=lambda x: str(x))
-    return uniq
+    with os.scandir(ROOT) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name in allow:
+                    _walk(entry.path, allow[name], files)
+            elif entry.is_file() and (name in ROOT_FILES or name.startswith("README")):
+                # root files + README*
+                files.append(entry.path)
+    return [pathlib.Path(p) for p in sorted(files)]
+
+def load_cache(path=CACHE_PATH):
+    try:
+        cache = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_cache(cache, path=CACHE_PATH):
+    # write-then-rename so an interrupted run never leaves a torn cache
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(cache, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+def cached_digests(files, jobs=None, use_cache=True):
+    """Digests for files, rehashing only those whose mtime/size changed since the last run."""
+    cache = load_cache() if use_cache else {}
+    rels = [str(p.relative_to(ROOT)) for p in files]
+    stats = [p.stat() for p in files]
+    todo = []
+    for i, (rel, st) in enumerate(zip(rels, stats)):
+        entry = cache.get(rel)
+        if not (isinstance(entry, list) and len(entry) == 3
+                and entry[:2] == [st.st_mtime_ns, st.st_size]):
+            todo.append(i)
+    for i, digest in zip(todo, hash_files([files[i] for i in todo], jobs=jobs)):
+        cache[rels[i]] = [stats[i].st_mtime_ns, stats[i].st_size, digest]
+    # drop entries for files that are gone (entries from the other bundle flavour stay)
+    current = set(rels)
+    for rel in [r for r in cache if r not in current]:
+        if not (ROOT / rel).is_file():
+            del cache[rel]
+    save_cache(cache)
+    return [cache[rel][2] for rel in rels], len(todo)
+
+def write_bin_manifest(path, rels, digests):
+    """Write 64-byte records sha256(rel) + raw digest, sorted by the path hash.
+
+    Fixed-width and sorted, so verify_archive.py can mmap it and bisect a
+    member's expected digest without parsing the text manifest.
+    """
+    records = sorted(hashlib.sha256(rel.encode("utf-8")).digest() + bytes.fromhex(digest)
+                     for rel, digest in zip(rels, digests))
+    with open(path, "wb") as fh:
+        fh.write(b"".join(records))
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--include-data", action="store_true", help="Include data/ directory")
     ap.add_argument("--out", default="reports/checksums_SHA256.txt")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel hashing workers (1 = serial)")
+    ap.add_argument("--no-cache", action="store_true", help="Ignore .checksums.cache.json and rehash every file")
     args = ap.parse_args()
 
     files = gather(include_data=args.include_data)
@@ -84,14 +158,17 @@ def main():
     outpath = ROOT / args.out
     outpath.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(outpath, "w", encoding="utf-8") as fh:
-        fh.write("# SHA256 checksums (relative to plr-prl/)\n")
-        for p in files:
-            rel = p.relative_to(ROOT)
-            digest = sha256_of(p)
-            fh.write(f"{digest}  {rel}\n")
+    digests, rehashed = cached_digests(files, jobs=args.jobs, use_cache=not args.no_cache)
+
+    rels = [str(p.relative_to(ROOT)) for p in files]
+    lines = ["# SHA256 checksums (relative to plr-prl/)\n"]
+    lines.extend(f"{digest}  {rel}\n" for rel, digest in zip(rels, digests))
+    with open(outpath, "wb") as fh:
+        fh.write("".join(lines).encode("utf-8"))
+    # written after the text, so its mtime marks it as current for verify_archive.py
+    write_bin_manifest(outpath.with_suffix(".bin"), rels, digests)
 
-    print(f"[ok] wrote {outpath} ({len(files)} files)")
+    print(f"[ok] wrote {outpath} ({len(files)} files, {rehashed} rehashed)")
 
 if __name__ == "__main__":
     main()
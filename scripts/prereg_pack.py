@@ -3,6 +3,8 @@
 prereg_pack.py — build a Zenodo-ready zip with PDFs, scripts, manifest, reports, and figs.
 Git-aware: If inside a Git repo, uses short commit hash as the tag by default.
 Falls back to YYYYMMDD. You can override with --tag.
+No-data runs cache the resolved file list in dist/.prereg_manifest.json and
+reuse it while no source directory changed.
 
 Usage:
   python scripts/prereg_pack.py --out dist/plr_prereg.zip
@@ -10,39 +12,99 @@ Options:
   --tag TAG            Override tag (default: git short hash or YYYYMMDD)
   --include-data       Include data/ directory (use with care; real data only).
   --name NAME          Base name (default: plr_prereg)
+  --jobs N             Parallel deflate workers (default: CPU count; 1 = serial)
 """
-import argparse, os, pathlib, zipfile, datetime, sys, subprocess
+import argparse, os, pathlib, json, zipfile, datetime, sys
+
+from _zipwrite import detect_git_tag, is_stored, is_streamed, iter_deflated, write_deflated, write_stored, iter_dir
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 
-def detect_git_tag():
+DEFLATE_LEVEL = 1
+
+def add_file(zf, src, arcname):
+    if is_stored(src) and zf._seekable:
+        write_stored(zf, src, arcname)
+        return
+    comp = zipfile.ZIP_STORED if is_stored(src) else zipfile.ZIP_DEFLATED
+    zf.write(src, arcname=str(arcname), compress_type=comp, compresslevel=DEFLATE_LEVEL)
+
+def write_plan(zf, plan, jobs):
+    """Write (src, arcname) entries in order; deflate runs ahead in worker processes.
+
+    Files above STREAM_MIN are left to ZipFile.write (add_file), which streams them.
+    """
+    if jobs <= 1:
+        for src, arc in plan:
+            add_file(zf, src, arc)
+        return
+    streamed = {src for src, _ in plan if not is_stored(src) and is_streamed(src)}
+    to_deflate = [src for src, _ in plan if not is_stored(src) and src not in streamed]
+    results = iter_deflated(to_deflate, DEFLATE_LEVEL, jobs)
+    for src, arc in plan:
+        if is_stored(src) or src in streamed:
+            add_file(zf, src, arc)
+            continue
+        crc, size, blob, _ = next(results)
+        write_deflated(zf, src, arc, crc, size, blob)
+
+def build_plan(include_data=False, dirs=None):
+    """Resolve the (src, arcname) list for the archive, in write order."""
+    plr = pathlib.Path("plr-prl")
+    if dirs is not None:
+        dirs.append((str(ROOT), os.stat(ROOT).st_mtime_ns))
+    needed_files = ["main.pdf", "supplemental.pdf", "manifest.yaml", "Makefile", "latexmkrc", "plr.bib"]
+    needed_files.extend(p.name for p in ROOT.glob("README*"))
+    plan = []
+    for f in needed_files:
+        fp = ROOT / f
+        if fp.exists():
+            plan.append((str(fp), str(plr / f)))
+    rep = ROOT / "reports"
+    if rep.exists():
+        plan.extend(iter_dir(rep, plr, dirs=dirs))
+    plan.extend(iter_dir(ROOT / "scripts", plr, dirs=dirs))
+    figs = ROOT / "figs"
+    if figs.exists():
+        plan.extend(iter_dir(figs, plr, exclude_ext=(".png",".jpg",".jpeg"), dirs=dirs))
+    if include_data and (ROOT / "data").exists():
+        plan.extend(iter_dir(ROOT / "data", plr, dirs=dirs))
+    return plan
+
+def load_cached_plan(path):
+    """Return the cached plan if no walked directory changed since it was saved, else None.
+
+    A directory's mtime moves whenever an entry is added, removed or renamed in it,
+    which is exactly what would change the plan; file contents do not matter here.
+    Paths are stored relative to ROOT and resolved against the current checkout,
+    so a copied tree never packs the files of the one it was copied from.
+    """
+    root = str(ROOT)
     try:
-        # Ensure we run inside ROOT
-        res = subprocess.run(
-            ["git", "-C", str(ROOT), "rev-parse", "--is-inside-work-tree"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
-        )
-        if res.stdout.strip() != "true":
-            return None
-        res2 = subprocess.run(
-            ["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
-        )
-        return res2.stdout.strip()
-    except Exception:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        for d, mtime in data["dirs"]:
+            if os.path.isabs(d) or os.stat(os.path.join(root, d)).st_mtime_ns != mtime:
+                return None
+        plan = []
+        for src, arc in data["plan"]:
+            if os.path.isabs(src):
+                return None
+            plan.append((os.path.join(root, src), arc))
+        return plan
+    except (OSError, ValueError, KeyError, TypeError):
         return None
 
-def add_dir(zf, base, relroot, exclude_ext=(), exclude_names=()):
-    for dirpath, dirnames, filenames in os.walk(base):
-        dirnames[:] = [d for d in dirnames if d not in ("__pycache__",) and not d.startswith(".")]
-        for fn in filenames:
-            if fn in exclude_names:
-                continue
-            if exclude_ext and any(fn.lower().endswith(ext.lower()) for ext in exclude_ext):
-                continue
-            full = pathlib.Path(dirpath) / fn
-            arc = relroot / full.relative_to(ROOT)
-            zf.write(full, arcname=str(arc))
+def save_cached_plan(path, plan, dirs):
+    root = str(ROOT)
+    data = {"dirs": [(os.path.relpath(d, root), mtime) for d, mtime in dirs],
+            "plan": [(os.path.relpath(src, root), arc) for src, arc in plan]}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+    # older versions kept one .prereg_manifest.<hash>.json per commit
+    for old in path.parent.glob(".prereg_manifest.*.json"):
+        old.unlink(missing_ok=True)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -50,6 +112,7 @@ def main():
     ap.add_argument("--tag", default=None)
     ap.add_argument("--include-data", action="store_true")
     ap.add_argument("--name", default="plr_prereg")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel deflate workers (1 = serial)")
     args = ap.parse_args()
 
     tag = args.tag or detect_git_tag() or datetime.datetime.utcnow().strftime("%Y%m%d")
@@ -57,29 +120,31 @@ def main():
     out = pathlib.Path(args.out) if args.out else (ROOT / "dist" / base_name)
     out.parent.mkdir(parents=True, exist_ok=True)
 
-    needed_files = ["main.pdf", "supplemental.pdf", "manifest.yaml", "Makefile", "latexmkrc", "plr.bib"]
-    readmes = [p.name for p in ROOT.glob("README*")]
-    needed_files.extend(readmes)
-
     missing = [f for f in ["main.pdf","supplemental.pdf"] if not (ROOT / f).exists()]
     if missing:
         print(f"[error] Missing built PDFs: {missing}. Run 'make release' first.", file=sys.stderr)
         sys.exit(1)
 
-    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
-        for f in needed_files:
-            fp = ROOT / f
-            if fp.exists():
-                zf.write(fp, arcname=str(pathlib.Path("plr-prl") / f))
-        rep = ROOT / "reports"
-        if rep.exists():
-            add_dir(zf, rep, pathlib.Path("plr-prl"))
-        add_dir(zf, ROOT / "scripts", pathlib.Path("plr-prl"))
-        figs = ROOT / "figs"
-        if figs.exists():
-            add_dir(zf, figs, pathlib.Path("plr-prl"), exclude_ext=(".png",".jpg",".jpeg"))
-        if args.include_data and (ROOT / "data").exists():
-            add_dir(zf, ROOT / "data", pathlib.Path("plr-prl"))
+    # No-data runs reuse the resolved file list; the directory mtimes it stores
+    # are what invalidate it, so one cache file serves every commit
+    cache = None if args.include_data else ROOT / "dist" / ".prereg_manifest.json"
+    plan = load_cached_plan(cache) if cache else None
+    if plan is None:
+        dirs = [] if cache else None
+        plan = build_plan(include_data=args.include_data, dirs=dirs)
+        if cache:
+            save_cached_plan(cache, plan, dirs)
+
+    # Built under a temporary name and renamed into place once closed, so a
+    # failed run never leaves a partial zip behind.
+    tmp = out.with_name(out.name + ".tmp")
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED, compresslevel=DEFLATE_LEVEL) as zf:
+            write_plan(zf, plan, args.jobs or 1)
+        os.replace(tmp, out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
     print(f"[OK] wrote {out}")
 
@@ -6,31 +6,345 @@ Reads checksums from reports/checksums_SHA256*.txt and compares to extracted fil
 Usage:
   python scripts/verify_archive.py dist/plr_zenodo_<tag>.zip
   python scripts/verify_archive.py dist/*.zip
+  python scripts/verify_archive.py --fast dist/*.zip   # CRC32 only, no manifests
+
+--fast only checks each member against the CRC32 stored in the archive
+(ZipFile.testzip): it catches corruption, not a wrong file. Use the default
+SHA256 check for release gates.
+
+When reports/checksums_SHA256*.bin (written by make_checksums.py after the
+text manifest) is present and not older than it, expected digests are looked
+up by bisecting the mmap-ed binary manifest instead of parsing the text.
+Likewise <archive>.idx (written by zenodo_pack.py) stands in for the central
+directory while its recorded size and mtime still match the archive.
+
+SHA256 speed depends on the backend: OpenSSL-backed hashlib (OpenSSL >= 1.1.1)
+uses SHA-NI / ARMv8 SHA2 instructions when the CPU has them. If hashlib fell
+back to its portable C code, the optional 'cryptography' package is used instead.
+The backend in use is printed at startup.
 """
+import os
 import sys
+import argparse
+import mmap
+import bisect
+import struct
+import zlib
 import pathlib
 import zipfile
 import hashlib
 import glob
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 
-def sha256_bytes(b: bytes) -> str:
-    h = hashlib.sha256()
-    h.update(b)
+CHUNK = 4 * 1024 * 1024
+# members up to this size are read in one call into a reused buffer and hashed in one shot
+SMALL_MAX = 1024 * 1024
+# Small members that sit close together are fetched with one os.pread per batch
+# (local headers and payloads alike) instead of a seek+read pair per member.
+BATCH_SPAN = 8 * 1024 * 1024
+BATCH_MAX = 64
+_LFH_SIG = b"PK\x03\x04"
+_LFH_SIZE = 30
+
+def _pick_sha256():
+    """Return (constructor, backend name) for the fastest available SHA256."""
+    if type(hashlib.sha256()).__module__ == "_hashlib":
+        return hashlib.sha256, "openssl"
+    try:
+        from cryptography.hazmat.primitives import hashes
+    except ImportError:
+        return hashlib.sha256, "builtin"
+
+    class CryptographySHA256:
+        # just enough of the hashlib interface for file_digest and the helpers below
+        def __init__(self, data=b""):
+            self._h = hashes.Hash(hashes.SHA256())
+            if data:
+                self._h.update(data)
+
+        def update(self, data):
+            self._h.update(data)
+
+        def hexdigest(self):
+            return self._h.finalize().hex()
+
+    return CryptographySHA256, "cryptography"
+
+SHA256, SHA256_BACKEND = _pick_sha256()
+
+def sha256_stream(fh) -> str:
+    """SHA256 of a binary file object (e.g. ZipExtFile), streamed in constant memory."""
+    if hasattr(hashlib, "file_digest"):
+        return hashlib.file_digest(fh, SHA256).hexdigest()
+    h = SHA256()
+    buf = bytearray(CHUNK)
+    view = memoryview(buf)
+    while True:
+        n = fh.readinto(buf)
+        if not n:
+            break
+        h.update(view[:n])
     return h.hexdigest()
 
-def load_manifest(lines):
-    checksums = {}
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith("#"):
+def sha256_member(zf, zinfo, buf=None) -> str:
+    """SHA256 of one archive member; small members go through buf (a bytearray)."""
+    with zf.open(zinfo) as fh:
+        if buf is not None and zinfo.file_size <= len(buf):
+            view = memoryview(buf)[:zinfo.file_size]
+            n = fh.readinto(view)
+            return SHA256(view[:n]).hexdigest()
+        return sha256_stream(fh)
+
+def preadable(zinfo):
+    """True if the member can be hashed from its raw bytes: unencrypted, stored or deflated."""
+    return (not zinfo.flag_bits & 0x1
+            and zinfo.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED))
+
+def batchable(zinfo):
+    """True if the member can go in a pread batch: preadable and small."""
+    return zinfo.compress_size <= SMALL_MAX and zinfo.file_size <= SMALL_MAX and preadable(zinfo)
+
+def _member_end(zinfo):
+    # the local header usually repeats the central directory's extra field;
+    # if it is longer, read_batch fetches the tail separately
+    return (zinfo.header_offset + _LFH_SIZE + len(zinfo.filename.encode("utf-8"))
+            + len(zinfo.extra) + zinfo.compress_size)
+
+def make_batches(work):
+    """Split header_offset-sorted work into pread batches and single items.
+
+    Returns a list of tasks: ("batch", [item, ...]), ("stream", item) for a
+    large member read with sha256_pread, or ("member", item) for one that
+    needs ZipFile (encrypted, other compression, or no os.pread).
+    """
+    tasks = []
+    batch, start = [], 0
+    for item in work:
+        zinfo = item[0]
+        if not hasattr(os, "pread") or not preadable(zinfo):
+            tasks.append(("member", item))
             continue
-        parts = line.split()
-        if len(parts) >= 2:
-            digest, rel = parts[0], parts[-1]
-            checksums[rel] = digest
-    return checksums
+        if not batchable(zinfo):
+            tasks.append(("stream", item))
+            continue
+        if batch and (len(batch) >= BATCH_MAX or _member_end(zinfo) - start > BATCH_SPAN):
+            tasks.append(("batch", batch))
+            batch = []
+        if not batch:
+            start = zinfo.header_offset
+        batch.append(item)
+    if batch:
+        tasks.append(("batch", batch))
+    return tasks
+
+def read_batch(fd, batch):
+    """Yield (item, payload) for a batch of members, from one pread of their byte range.
+
+    payload is the member's uncompressed data, or None if its local header is bad.
+    """
+    start = batch[0][0].header_offset
+    buf = os.pread(fd, _member_end(batch[-1][0]) - start, start)
+    view = memoryview(buf)
+    for item in batch:
+        zinfo = item[0]
+        pos = zinfo.header_offset - start
+        if view[pos:pos + 4] != _LFH_SIG:
+            yield item, None
+            continue
+        name_len, extra_len = struct.unpack_from("<HH", buf, pos + 26)
+        pos += _LFH_SIZE + name_len + extra_len
+        data = view[pos:pos + zinfo.compress_size]
+        if len(data) < zinfo.compress_size:
+            data = os.pread(fd, zinfo.compress_size, start + pos)
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            try:
+                data = zlib.decompress(data, -15)
+            except zlib.error:
+                data = None
+        yield item, data
+
+def sha256_pread(fd, zinfo):
+    """SHA256 of a preadable member, streamed with os.pread from its local header.
+
+    Deflated data goes through a zlib.decompressobj at most CHUNK bytes at a
+    time, so memory stays constant. Returns None if the member is damaged.
+    """
+    head = os.pread(fd, _LFH_SIZE, zinfo.header_offset)
+    if len(head) < _LFH_SIZE or head[:4] != _LFH_SIG:
+        return None
+    name_len, extra_len = struct.unpack_from("<HH", head, 26)
+    pos = zinfo.header_offset + _LFH_SIZE + name_len + extra_len
+    end = pos + zinfo.compress_size
+    d = zlib.decompressobj(-15) if zinfo.compress_type == zipfile.ZIP_DEFLATED else None
+    h = SHA256()
+    size = 0
+    try:
+        while pos < end:
+            data = os.pread(fd, min(CHUNK, end - pos), pos)
+            if not data:
+                return None
+            pos += len(data)
+            if d is None:
+                h.update(data)
+                size += len(data)
+                continue
+            while data:
+                out = d.decompress(data, CHUNK)
+                h.update(out)
+                size += len(out)
+                data = d.unconsumed_tail
+        if d is not None:
+            out = d.flush()
+            h.update(out)
+            size += len(out)
+            if not d.eof:
+                return None
+    except zlib.error:
+        return None
+    return h.hexdigest() if size == zinfo.file_size else None
+
+def load_manifest(path):
+    """Yield (rel, digest) pairs from a "<digest>  <relative-path>" manifest file.
+
+    Read in one go and split in C; only the two surviving fields are decoded.
+    """
+    with open(path, "rb") as fh:
+        buf = fh.read()
+    for line in buf.splitlines():
+        if line[:1].isspace():
+            line = line.strip()
+        if not line or line.startswith(b"#"):
+            continue
+        digest, _, rel = line.partition(b" ")
+        rel = rel.strip()
+        if rel:
+            yield rel.decode("utf-8"), digest.decode("ascii", "replace")
+
+# binary manifest record: sha256(rel path) + raw sha256 of the file, sorted by the former
+RECORD = 64
+# Importing NumPy costs ~85 ms; searchsorted saves ~3.5 us per key over the
+# bisect loop, so it only pays off from about this many lookups.
+NUMPY_MIN_KEYS = 25000
+
+class BinManifest:
+    """Read-only mmap view of a sorted binary manifest (see make_checksums.write_bin_manifest).
+
+    Indexing yields the path hash of record i, so bisect works on the object directly.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size % RECORD:
+                raise ValueError(f"{path}: size is not a multiple of {RECORD}")
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._n = size // RECORD
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        off = i * RECORD
+        return self._mm[off:off + 32]
+
+    def get(self, key):
+        """Hex digest recorded for path hash key, or None."""
+        i = bisect.bisect_left(self, key)
+        if i < self._n and self[i] == key:
+            off = i * RECORD + 32
+            return self._mm[off:off + 32].hex()
+        return None
+
+    def get_many(self, keys):
+        """[hex digest or None] for each path hash in keys.
+
+        For NUMPY_MIN_KEYS keys or more (and NumPy installed), one searchsorted
+        over the records' 8-byte big-endian prefixes plus a row-wise compare of
+        the full keys replaces a Python bisect per key.
+        """
+        np = None
+        if self._n and len(keys) >= NUMPY_MIN_KEYS:
+            try:
+                import numpy as np
+            except ImportError:  # optional: bisect below is always correct
+                pass
+        if np is None:
+            return [self.get(k) for k in keys]
+        recs = np.frombuffer(self._mm, dtype=np.uint8).reshape(self._n, RECORD)
+        prefixes = np.frombuffer(self._mm, dtype=">u8")[::RECORD // 8]
+        query = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), 32)
+        pos = np.searchsorted(prefixes, np.frombuffer(query.tobytes(), dtype=">u8")[::4])
+        rows = recs[np.minimum(pos, self._n - 1)]
+        hit = (pos < self._n) & (rows[:, :32] == query).all(axis=1)
+        out = []
+        for i, key in enumerate(keys):
+            if hit[i]:
+                out.append(rows[i, 32:].tobytes().hex())
+            elif pos[i] < self._n and rows[i, :8].tobytes() == key[:8]:
+                out.append(self.get(key))  # another path shares the 8-byte prefix; bisect it
+            else:
+                out.append(None)
+        return out
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+
+def load_bin_manifest(txt_path):
+    """BinManifest for the .bin next to txt_path, or None if missing, stale or malformed."""
+    path = txt_path.with_suffix(".bin")
+    try:
+        if path.stat().st_mtime_ns < txt_path.stat().st_mtime_ns:
+            return None
+        return BinManifest(path)
+    except (OSError, ValueError):
+        return None
+
+def resolve_from_bins(members, bins, manfiles):
+    """Pair archive members with their expected digests using binary manifests.
+
+    The last manifest that lists a path wins, as with the text manifests.
+    Returns (work, missing): [(zinfo, digest)] and the arcnames of manifest
+    entries with no member in the archive. Hashed paths cannot name those,
+    so only a text manifest whose .bin has unmatched records is read, and
+    only to report them.
+    """
+    members = [zi for zi in members if zi.filename.startswith("plr-prl/")]
+    keys = [hashlib.sha256(zi.filename[8:].encode("utf-8")).digest() for zi in members]
+    expected = [None] * len(members)
+    missing = set()
+    names = None
+    for b, mf in zip(reversed(bins), reversed(manfiles)):
+        digests = b.get_many(keys)
+        if len(digests) - digests.count(None) != len(b):
+            if names is None:
+                names = {zi.filename for zi in members}
+            missing.update(arc for arc in (f"plr-prl/{rel}" for rel, _ in load_manifest(mf))
+                           if arc not in names)
+        expected = [e if e is not None else d for e, d in zip(expected, digests)]
+    return [(zi, e) for zi, e in zip(members, expected) if e is not None], sorted(missing)
+
+def load_index(archive):
+    """ZipInfo list from archive's .idx sidecar, or None if it is missing or stale."""
+    path = pathlib.Path(str(archive) + ".idx")
+    try:
+        idx = json.loads(path.read_text(encoding="utf-8"))
+        st = os.stat(archive)
+        if idx["size"] != st.st_size or idx["mtime_ns"] != st.st_mtime_ns:
+            return None
+        members = []
+        for name, offset, csize, fsize, crc, ctype, flags, extra in idx["members"]:
+            zi = zipfile.ZipInfo(name)
+            zi.header_offset, zi.compress_size, zi.file_size = offset, csize, fsize
+            zi.CRC, zi.compress_type, zi.flag_bits = crc, ctype, flags
+            zi.extra = bytes.fromhex(extra)
+            members.append(zi)
+        return members
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
 
 def verify_archive(archive_path):
     """Verify a single archive against manifests. Returns True if OK, False otherwise."""
@@ -52,36 +366,105 @@ def verify_archive(archive_path):
         print(f"[fail] no checksum manifests found in {reports_dir}", file=sys.stderr)
         return False
     
-    # combine
-    all_checksums = {}
-    for mf in manfiles:
-        with open(mf, "r", encoding="utf-8") as fh:
-            all_checksums.update(load_manifest(fh.readlines()))
-    
-    # open archive
-    zf = zipfile.ZipFile(archive, "r")
+    # Parse the central directory once, resolve every manifest entry against it,
+    # and hash in header_offset order so reads sweep the archive front to back.
+    members = load_index(archive)
+    if members is None:
+        with zipfile.ZipFile(archive, "r") as zf:
+            members = zf.infolist()
+    infomap = {zi.filename: zi for zi in members}
+    results = []
+    work = None
+    bins = [load_bin_manifest(mf) for mf in manfiles]
+    if all(b is not None for b in bins):
+        work, missing = resolve_from_bins(infomap.values(), bins, manfiles)
+        results.extend((arcname, "missing") for arcname in missing)
+    for b in bins:
+        if b is not None:
+            b.close()
+    if work is None:
+        # combine
+        all_checksums = {}
+        # last manifest wins (the data manifest overrides the no-data one)
+        for mf in reversed(manfiles):
+            for rel, digest in load_manifest(mf):
+                all_checksums.setdefault(rel, digest)
+        work = []
+        for rel, digest in all_checksums.items():
+            arcname = f"plr-prl/{rel}"
+            zinfo = infomap.get(arcname)
+            if zinfo is None:
+                results.append((arcname, "missing"))
+            else:
+                work.append((zinfo, digest))
+    work.sort(key=lambda w: w[0].header_offset)
+    bufsize = min(max((zi.file_size for zi, _ in work), default=0), SMALL_MAX)
+
+    # zlib and hashlib drop the GIL, so threads hash members in parallel.
+    # os.pread takes an explicit offset, so one fd serves every batch and
+    # stream task. Only "member" tasks need a ZipFile, and a ZipFile handle is
+    # not safe for concurrent reads: those get one per worker thread.
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def verify_one(item):
+        zinfo, digest = item
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(archive, "r")
+            local.buf = bytearray(bufsize)
+            with handles_lock:
+                handles.append(zf)
+        got = sha256_member(zf, zinfo, local.buf)
+        return zinfo.filename, "ok" if got == digest else "mismatch"
+
+    def verify_batch(batch):
+        out = []
+        for (zinfo, digest), data in read_batch(fd, batch):
+            ok = (data is not None and len(data) == zinfo.file_size
+                  and SHA256(data).hexdigest() == digest)
+            out.append((zinfo.filename, "ok" if ok else "mismatch"))
+        return out
+
+    def verify_stream(item):
+        zinfo, digest = item
+        return zinfo.filename, "ok" if sha256_pread(fd, zinfo) == digest else "mismatch"
+
+    def run(task):
+        kind, arg = task
+        if kind == "batch":
+            return verify_batch(arg)
+        return [verify_stream(arg) if kind == "stream" else verify_one(arg)]
+
+    tasks = make_batches(work)
+    fd = os.open(archive, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        # never start more workers than there are tasks
+        workers = max(1, min(len(tasks), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for res in ex.map(run, tasks):
+                results.extend(res)
+    finally:
+        os.close(fd)
+        for zf in handles:
+            zf.close()
+    results.sort()
+
     ok_all = True
     verified_count = 0
     failed_count = 0
-    
-    for rel, digest in all_checksums.items():
-        arcname = str(pathlib.Path("plr-prl") / rel)
-        try:
-            data = zf.read(arcname)
-        except KeyError:
+    for arcname, status in results:
+        if status == "missing":
             print(f"[fail] missing {arcname} in archive")
-            ok_all = False
-            failed_count += 1
-            continue
-        got = sha256_bytes(data)
-        if got != digest:
+        elif status == "mismatch":
             print(f"[fail] checksum mismatch for {arcname}")
-            ok_all = False
-            failed_count += 1
         else:
             print(f"[ok] {arcname}")
             verified_count += 1
-    zf.close()
+            continue
+        ok_all = False
+        failed_count += 1
     
     # Print summary for this archive
     if ok_all:
@@ -91,14 +474,40 @@ def verify_archive(archive_path):
     
     return ok_all
 
+def verify_crc(archive_path):
+    """Shallow check: every member's data matches its stored CRC32. Returns True if OK."""
+    archive = pathlib.Path(archive_path)
+    if not archive.is_file():
+        print(f"[fail] archive {archive} not found", file=sys.stderr)
+        return False
+    try:
+        with zipfile.ZipFile(archive, "r") as zf:
+            bad = zf.testzip()
+            count = len(zf.infolist())
+    except (zipfile.BadZipFile, OSError) as e:
+        print(f"[fail] {archive.name}: {e}")
+        return False
+    if bad is not None:
+        print(f"[fail] CRC32 mismatch for {bad}")
+        return False
+    print(f"[ok] crc32 verified ({count} members)")
+    return True
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: verify_archive.py <archive.zip> [<archive2.zip> ...]", file=sys.stderr)
-        sys.exit(1)
+    ap = argparse.ArgumentParser(description="Verify zip archives against the SHA256 manifests in reports/.")
+    ap.add_argument("archives", nargs="+", metavar="archive.zip", help="Archive path(s); globs are expanded")
+    ap.add_argument("--fast", action="store_true",
+                    help="Only check stored CRC32s (zf.testzip); skips the SHA256 manifest check")
+    args = ap.parse_args()
+
+    if not args.fast:
+        print(f"[note] sha256 backend: {SHA256_BACKEND}")
+        if SHA256_BACKEND == "builtin":
+            print("[warn] hashlib is not OpenSSL-backed; install 'cryptography' for hardware-accelerated SHA256")
     
     # Collect all archive paths (expand globs if needed)
     archives = []
-    for arg in sys.argv[1:]:
+    for arg in args.archives:
         # Support shell expansion by expanding globs
         expanded = glob.glob(arg)
         if expanded:
@@ -116,7 +525,7 @@ def main():
         if i > 0:
             print()  # blank line between archives
         print(f"=== Verifying {archive} ===")
-        ok = verify_archive(archive)
+        ok = verify_crc(archive) if args.fast else verify_archive(archive)
         all_ok = all_ok and ok
     
     if all_ok:
@@ -4,7 +4,17 @@ zenodo_pack.py — produce a single Zenodo-ready archive including metadata stub
 Git-aware tag (short hash), with fallback to YYYYMMDD. Optionally include raw data.
 
 Usage:
-  python scripts/zenodo_pack.py --out dist/plr_zenodo.zip [--include-data] [--tag TAG]
+  python scripts/zenodo_pack.py --out dist/plr_zenodo.zip [--include-data] [--tag TAG] [--jobs N]
+                                [--verify] [--manifest-out PATH] [--no-zipcache]
+
+--verify / --manifest-out hash every source file as it is packed (the bytes are
+read once for both) and check those digests against reports/checksums_SHA256*.txt.
+That catches stale manifests early; it does not check the written zip, which
+is what verify_archive.py (make verify-archive) is for.
+
+Deflate output is cached in .zipcache/ per (path, size, mtime, level); files
+unchanged since the last run are copied into the archive without recompressing.
+Pass --no-zipcache to deflate everything from scratch.
 
 Contents:
   - PDFs: main.pdf, supplemental.pdf
@@ -14,44 +24,216 @@ Contents:
   - Scripts/: builders and checks
   - Figs/: PDFs
   - Data/: (optional with --include-data)
+
+Next to the archive, <out>.idx (JSON) records each member's central-directory
+fields plus the archive's size and mtime; verify_archive.py uses it instead of
+re-parsing the central directory while it still matches the archive.
 """
-import argparse, os, pathlib, zipfile, subprocess, datetime, sys
+import argparse, os, pathlib, json, hashlib, zipfile, zlib, datetime, sys
+
+from _zipwrite import (detect_git_tag, is_stored, is_streamed, deflate_one, iter_deflated,
+                       write_deflated, write_streamed, write_stored, iter_dir)
+from verify_archive import load_manifest
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 
-def detect_git_tag():
-    try:
-        res = subprocess.run(
-            ["git", "-C", str(ROOT), "rev-parse", "--is-inside-work-tree"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
-        )
-        if res.stdout.strip() != "true":
+DEFLATE_LEVEL = 3
+
+WRITE_BUFFER = 8 * 1024 * 1024
+
+# deflate streams of unchanged sources, reused across runs (see ZipCache)
+ZIPCACHE_DIR = ROOT / ".zipcache"
+
+class ZipCache:
+    """Deflate output per source file, reused while the file is unchanged.
+
+    Entries are keyed by (path, size, mtime_ns, DEFLATE_LEVEL): <key>.deflate
+    holds the raw deflate stream, <key>.json its CRC, sizes and the sha256 of
+    the stream. The .json is written last, so its presence means the entry is
+    complete.
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def key(self, src):
+        st = os.stat(src)
+        rel = os.path.relpath(src, ROOT)
+        raw = f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\0{DEFLATE_LEVEL}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def has(self, key):
+        return (self.path / f"{key}.json").is_file()
+
+    def load(self, key, hashed=False):
+        """Return (crc32, size, blob, sha256 or None) for key, or None if the entry is unusable.
+
+        The blob must match the checksum recorded when it was stored. With
+        hashed, the blob is inflated and the sha256 is taken from those bytes,
+        so the digest describes what goes into the zip, not what was cached.
+        """
+        try:
+            meta = json.loads((self.path / f"{key}.json").read_text(encoding="utf-8"))
+            blob = (self.path / f"{key}.deflate").read_bytes()
+            if len(blob) != meta["compress_size"] or hashlib.sha256(blob).hexdigest() != meta["blob_sha256"]:
+                return None
+            digest = None
+            if hashed:
+                data = zlib.decompress(blob, -15)
+                if len(data) != meta["size"] or zlib.crc32(data) != meta["crc"]:
+                    return None
+                digest = hashlib.sha256(data).hexdigest()
+            return meta["crc"], meta["size"], blob, digest
+        except (OSError, ValueError, KeyError, TypeError, zlib.error):
             return None
-        res2 = subprocess.run(
-            ["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
-        )
-        return res2.stdout.strip()
-    except Exception:
-        return None
-
-def add_dir(zf, base, relroot, exclude_ext=(), exclude_names=()):
-    for dirpath, dirnames, filenames in os.walk(base):
-        dirnames[:] = [d for d in dirnames if d not in ("__pycache__",) and not d.startswith(".")]
-        for fn in filenames:
-            if fn in exclude_names:
-                continue
-            if exclude_ext and any(fn.lower().endswith(ext.lower()) for ext in exclude_ext):
+
+    def store(self, key, src, result):
+        crc, size, blob, _ = result
+        meta = {"src": os.path.relpath(src, ROOT), "crc": crc, "size": size,
+                "compress_size": len(blob), "blob_sha256": hashlib.sha256(blob).hexdigest()}
+        for name, data in ((f"{key}.deflate", blob), (f"{key}.json", json.dumps(meta).encode("utf-8"))):
+            tmp = self.path / (name + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, self.path / name)
+
+    def prune(self, keep, srcs):
+        """Drop entries superseded for files in srcs, and entries whose source is gone.
+
+        Entries for files outside this run (e.g. data/ on a no-data run) are kept.
+        """
+        srcs = {os.path.relpath(s, ROOT) for s in srcs}
+        for meta_path in self.path.glob("*.json"):
+            key = meta_path.stem
+            if key in keep:
                 continue
-            full = pathlib.Path(dirpath) / fn
-            arc = relroot / full.relative_to(ROOT)
-            zf.write(full, arcname=str(arc))
+            try:
+                src = json.loads(meta_path.read_text(encoding="utf-8"))["src"]
+            except (OSError, ValueError, KeyError, TypeError):
+                src = None
+            if src is None or src in srcs or not (ROOT / src).is_file():
+                for p in (meta_path, self.path / f"{key}.deflate"):
+                    try:
+                        p.unlink()
+                    except FileNotFoundError:
+                        pass
+
+def write_plan(zf, plan, jobs, hashed=False, cache=None):
+    """Write (src, arcname) entries in order; deflate runs ahead in worker processes.
+
+    With a ZipCache, unchanged sources reuse their stored deflate stream and
+    only the rest are compressed. Files above STREAM_MIN bypass both and are
+    streamed by ZipFile.write. Returns {arcname: sha256 of the entry data} if
+    hashed, else an empty dict.
+    """
+    digests = {}
+    streamed = {src for src, _ in plan if not is_stored(src) and is_streamed(src)}
+    deflated = [src for src, _ in plan if not is_stored(src) and src not in streamed]
+    keys = {src: cache.key(src) for src in deflated} if cache else {}
+    hits = {src for src, key in keys.items() if cache.has(key)}
+    to_deflate = [src for src in deflated if src not in hits]
+    fill = cache is not None
+    results = iter_deflated(to_deflate, DEFLATE_LEVEL, jobs if len(plan) >= 2 else 1, hashed)
+    for src, arc in plan:
+        if is_stored(src):
+            digest = write_stored(zf, src, arc, hashed)
+        elif src in streamed:
+            digest = write_streamed(zf, src, arc, DEFLATE_LEVEL, hashed)
+        else:
+            result = cache.load(keys[src], hashed) if src in hits else None
+            if result is None:
+                result = deflate_one(src, DEFLATE_LEVEL, hashed) if src in hits else next(results)
+                if fill:
+                    cache.store(keys[src], src, result)
+            crc, size, blob, digest = result
+            write_deflated(zf, src, arc, crc, size, blob)
+        if hashed:
+            digests[str(arc)] = digest
+    if fill:
+        # streamed files no longer use the cache: drop their old entries too
+        cache.prune(set(keys.values()), set(keys) | streamed)
+    return digests
+
+def write_manifest(path, digests):
+    """Write a make_checksums-style manifest ("<digest>  <path relative to plr-prl/>")."""
+    lines = ["# SHA256 checksums (relative to plr-prl/)\n"]
+    lines.extend(f"{digest}  {arc[len('plr-prl/'):]}\n" for arc, digest in sorted(digests.items()))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write("".join(lines).encode("utf-8"))
+
+def verify_digests(digests):
+    """Check pack-time source digests against reports/checksums_SHA256*.txt.
+
+    Every manifest entry must have been packed from a file with the recorded
+    digest. This checks the sources, not the bytes in the zip: run
+    verify_archive.py on the result for that. Returns True if OK.
+    """
+    manfiles = [ROOT / "reports" / n for n in ["checksums_SHA256.txt", "checksums_SHA256_data.txt"]]
+    manfiles = [mf for mf in manfiles if mf.is_file()]
+    if not manfiles:
+        print(f"[fail] no checksum manifests found in {ROOT / 'reports'}", file=sys.stderr)
+        return False
+    expected = {}
+    # last manifest wins (the data manifest overrides the no-data one)
+    for mf in reversed(manfiles):
+        for rel, digest in load_manifest(mf):
+            expected.setdefault(rel, digest)
+    verified = failed = 0
+    for rel, digest in sorted(expected.items()):
+        arc = f"plr-prl/{rel}"
+        got = digests.get(arc)
+        if got is None:
+            print(f"[fail] missing {arc} in archive")
+        elif got != digest:
+            print(f"[fail] checksum mismatch for {arc}")
+        else:
+            print(f"[ok] {arc}")
+            verified += 1
+            continue
+        failed += 1
+    if failed:
+        print(f"[fail] pack-time verify: {failed} failed, {verified} ok")
+        return False
+    print(f"[ok] pack-time verify: {verified} files match manifests")
+    return True
+
+def write_index(out, members):
+    """Write out.idx: the fields verify_archive.py needs per member, stamped with out's size/mtime."""
+    st = os.stat(out)
+    idx = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "members": [[zi.filename, zi.header_offset, zi.compress_size, zi.file_size, zi.CRC,
+                     zi.compress_type, zi.flag_bits, zi.extra.hex()] for zi in members],
+    }
+    path = pathlib.Path(str(out) + ".idx")
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(idx), encoding="utf-8")
+    os.replace(tmp, path)
+
+def scan_entries(path):
+    """{name: os.DirEntry} for one directory (empty if it does not exist), in scandir order."""
+    try:
+        with os.scandir(path) as it:
+            return {entry.name: entry for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+
+def entry_is_dir(entries, name):
+    entry = entries.get(name)
+    return entry is not None and entry.is_dir()
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", default=None)
     ap.add_argument("--include-data", action="store_true")
     ap.add_argument("--tag", default=None)
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel deflate workers (1 = serial)")
+    ap.add_argument("--verify", action="store_true",
+                    help="Check packed files against reports/checksums_SHA256*.txt while packing")
+    ap.add_argument("--manifest-out", default=None, help="Also write a SHA256 manifest of the packed files")
+    ap.add_argument("--no-zipcache", action="store_true",
+                    help="Ignore .zipcache/ and deflate every file from scratch")
     args = ap.parse_args()
 
     tag = args.tag or detect_git_tag() or datetime.datetime.utcnow().strftime("%Y%m%d")
@@ -59,39 +241,68 @@ def main():
     out = pathlib.Path(args.out) if args.out else (ROOT / "dist" / base_name)
     out.parent.mkdir(parents=True, exist_ok=True)
 
+    # one directory read each for ROOT and dist/; every probe below is a dict lookup
+    root = scan_entries(ROOT)
+    dist = scan_entries(ROOT / "dist")
+
     # Require PDFs
-    missing = [f for f in ["main.pdf","supplemental.pdf"] if not (ROOT / f).exists()]
+    missing = [f for f in ["main.pdf","supplemental.pdf"] if f not in root]
     if missing:
         print(f"[error] Missing built PDFs: {missing}. Run 'make release' first.", file=sys.stderr)
         sys.exit(1)
 
-    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
-        # Root build files
-        for f in ["main.pdf","supplemental.pdf","manifest.yaml","Makefile","latexmkrc","plr.bib"]:
-            fp = ROOT / f
-            if fp.exists():
-                zf.write(fp, arcname=str(pathlib.Path("plr-prl") / f))
-        # README*
-        for fp in ROOT.glob("README*"):
-            zf.write(fp, arcname=str(pathlib.Path("plr-prl") / fp.name))
-        # Metadata from dist
-        for f in ["CITATION.cff","zenodo.json"]:
-            fp = ROOT / "dist" / f
-            if fp.exists():
-                zf.write(fp, arcname=str(pathlib.Path("plr-prl") / f))
-        # Reports, Scripts, Figs
-        rep = ROOT / "reports"
-        if rep.exists():
-            add_dir(zf, rep, pathlib.Path("plr-prl"))
-        add_dir(zf, ROOT / "scripts", pathlib.Path("plr-prl"))
-        figs = ROOT / "figs"
-        if figs.exists():
-            add_dir(zf, figs, pathlib.Path("plr-prl"), exclude_ext=(".png",".jpg",".jpeg"))
-        # Data optional
-        if args.include_data and (ROOT / "data").exists():
-            add_dir(zf, ROOT / "data", pathlib.Path("plr-prl"))
+    plr = pathlib.Path("plr-prl")
+    plan = []
+    # Root build files
+    for f in ["main.pdf","supplemental.pdf","manifest.yaml","Makefile","latexmkrc","plr.bib"]:
+        if f in root:
+            plan.append((root[f].path, plr / f))
+    # README*
+    for name, entry in root.items():
+        if name.startswith("README"):
+            plan.append((entry.path, plr / name))
+    # Metadata from dist
+    for f in ["CITATION.cff","zenodo.json"]:
+        entry = dist.get(f)
+        if entry is not None:
+            plan.append((entry.path, plr / f))
+    # Reports, Scripts, Figs
+    if entry_is_dir(root, "reports"):
+        plan.extend(iter_dir(root["reports"].path, plr))
+    plan.extend(iter_dir(ROOT / "scripts", plr))
+    if entry_is_dir(root, "figs"):
+        plan.extend(iter_dir(root["figs"].path, plr, exclude_ext=(".png",".jpg",".jpeg")))
+    # Data optional
+    if args.include_data and entry_is_dir(root, "data"):
+        plan.extend(iter_dir(root["data"].path, plr))
+
+    # Every entry's CRC and sizes are known before its local header is written
+    # (see _zipwrite.append_entry), so nothing seeks back and the 8 MiB buffer only
+    # reaches the disk in large sequential writes. The exception is files above
+    # STREAM_MIN: ZipFile.write streams those and patches their header after.
+    # The archive is built under a temporary name and renamed into place once
+    # closed: readers never see a partial zip. No fsync anywhere; the page
+    # cache writes it back on its own.
+    tmp = out.with_name(out.name + ".tmp")
+    try:
+        with open(tmp, "wb", buffering=WRITE_BUFFER) as fp, \
+             zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED, compresslevel=DEFLATE_LEVEL) as zf:
+            cache = None if args.no_zipcache else ZipCache(ZIPCACHE_DIR)
+            digests = write_plan(zf, plan, args.jobs or 1, hashed=args.verify or bool(args.manifest_out),
+                                 cache=cache)
+            members = zf.infolist()
+        os.replace(tmp, out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    write_index(out, members)
+    if args.manifest_out:
+        write_manifest(ROOT / args.manifest_out, digests)
+        print(f"[ok] wrote {args.manifest_out} ({len(digests)} files)")
 
     print(f"[OK] wrote {out}")
+    if args.verify and not verify_digests(digests):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -3,9 +3,15 @@
 zenodo_preflight.py — sanity-check metadata files before packaging for Zenodo.
 - Validates presence and required fields in dist/CITATION.cff (YAML) and dist/zenodo.json (JSON).
 - Prints clear [ok]/[warn]/[fail] lines and exits nonzero on failure.
+- Parses YAML with libyaml (CSafeLoader) when PyYAML was built with it.
 """
 import sys, os, json, yaml
 
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+
 def ok(msg): print(f"[ok] {msg}")
 def warn(msg): print(f"[warn] {msg}")
 def fail(msg): print(f"[fail] {msg}")
@@ -16,7 +22,7 @@ def validate_citation(path):
         return False
     try:
         with open(path, "r", encoding="utf-8") as fh:
-            cff = yaml.safe_load(fh)
+            cff = yaml.load(fh, Loader=YamlLoader)
     except Exception as e:
         fail(f"CITATION.cff parse error: {e}")
         return False
@@ -0,0 +1,4 @@
+import pathlib, sys
+
+# the scripts are standalone files, not a package: import them from scripts/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "scripts"))
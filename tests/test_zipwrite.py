@@ -0,0 +1,96 @@
+"""
+Round-trip checks for the hand-written zip entries (_zipwrite.append_entry)
+and the hand-parsed reads in verify_archive.py, so a CPython zipfile change
+fails here instead of in a release archive.
+"""
+import hashlib, os, random, zipfile
+
+import pytest
+
+import _zipwrite
+import verify_archive
+import zenodo_pack
+
+SMALL = verify_archive.SMALL_MAX
+
+def make_tree(root):
+    """{rel: path} covering small, large, empty, stored and deflated members."""
+    rng = random.Random(0)
+    files = {
+        "reports/note.txt": b"hello\n",
+        "reports/empty.txt": b"",
+        "reports/big.txt": "".join(f"{i},{i * 7 % 13}\n" for i in range(SMALL // 2)).encode(),
+        "figs/a.pdf": rng.randbytes(4096),
+        "main.pdf": rng.randbytes(2 * SMALL),
+        "scripts/tool.py": b"print('x')\n" * 500,
+    }
+    paths = {}
+    for rel, data in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        paths[rel] = path
+    lines = [f"{hashlib.sha256(data).hexdigest()}  {rel}\n" for rel, data in files.items()]
+    (root / "reports" / "checksums_SHA256.txt").write_text("".join(lines), encoding="utf-8")
+    return paths
+
+def pack_append_entry(out, paths):
+    # as zenodo_pack.main: a buffered file object, stored and pre-deflated entries,
+    # plus one ZipFile.write entry in between (write_streamed)
+    with open(out, "wb", buffering=1 << 16) as fp, zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED) as zf:
+        for rel, src in paths.items():
+            arc = f"plr-prl/{rel}"
+            if _zipwrite.is_stored(src):
+                _zipwrite.write_stored(zf, src, arc)
+            elif rel == "scripts/tool.py":
+                _zipwrite.write_streamed(zf, src, arc, 3)
+            else:
+                crc, size, blob, _ = _zipwrite.deflate_one(src, 3)
+                _zipwrite.write_deflated(zf, src, arc, crc, size, blob)
+        members = zf.infolist()
+    return members
+
+def pack_zf_write(out, paths):
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for rel, src in paths.items():
+            comp = zipfile.ZIP_STORED if _zipwrite.is_stored(src) else zipfile.ZIP_DEFLATED
+            zf.write(src, arcname=f"plr-prl/{rel}", compress_type=comp)
+        members = zf.infolist()
+    return members
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(verify_archive, "ROOT", tmp_path)
+    return make_tree(tmp_path)
+
+@pytest.mark.parametrize("pack", [pack_append_entry, pack_zf_write])
+@pytest.mark.parametrize("read", ["pread", "pread+idx", "zipfile"])
+def test_verify_accepts_archive(tmp_path, tree, monkeypatch, pack, read):
+    out = tmp_path / "dist" / "t.zip"
+    out.parent.mkdir()
+    members = pack(out, tree)
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        for rel, src in tree.items():
+            assert zf.read(f"plr-prl/{rel}") == src.read_bytes()
+    if read == "pread+idx":
+        zenodo_pack.write_index(out, members)
+        assert verify_archive.load_index(out) is not None
+    if read == "zipfile":
+        monkeypatch.delattr(os, "pread")
+    assert verify_archive.verify_archive(out)
+
+@pytest.mark.parametrize("rel", ["reports/note.txt", "reports/big.txt", "main.pdf"])
+def test_verify_rejects_flipped_byte(tmp_path, tree, rel):
+    out = tmp_path / "t.zip"
+    pack_append_entry(out, tree)
+    with zipfile.ZipFile(out) as zf:
+        zinfo = zf.getinfo(f"plr-prl/{rel}")
+    off = (zinfo.header_offset + 30 + len(zinfo.filename.encode()) + len(zinfo.extra)
+           + zinfo.compress_size // 2)
+    with open(out, "r+b") as fh:
+        fh.seek(off)
+        byte = fh.read(1)
+        fh.seek(off)
+        fh.write(bytes([byte[0] ^ 0xFF]))
+    assert not verify_archive.verify_archive(out)